@@ -74,6 +74,20 @@ class HTTPAdapterPlugin(Star):
             "hint": "CORS 允许的源，多个用逗号分隔，* 表示允许所有",
             "default": "*"
         },
+        "max_stream_connections": {
+            "description": "最大流式连接数",
+            "type": "int",
+            "hint": "同时处理的 SSE 流式连接上限，超出的连接返回 503，0 表示不限制",
+            "default": 256,
+            "min": 0
+        },
+        "max_pending_responses": {
+            "description": "最大待处理请求数",
+            "type": "int",
+            "hint": "同时等待回复的标准请求上限，超出时直接返回 503，0 表示不限制",
+            "default": 1024,
+            "min": 0
+        },
     }
 
     _registered: bool = False
@@ -31,6 +31,7 @@ HTTP_STATUS_CODE = MappingProxyType({
     "FORBIDDEN": 403,
     "NOT_FOUND": 404,
     "TIMEOUT": 504,
-    "INTERNAL_ERROR": 500
+    "INTERNAL_ERROR": 500,
+    "SERVICE_UNAVAILABLE": 503
 })
 
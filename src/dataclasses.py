@@ -3,7 +3,7 @@ HTTP 适配器数据类定义
 """
 import time
 from dataclasses import dataclass, field
-from typing import Any, Dict, Optional
+from typing import Any, Dict, NamedTuple, Optional
 import asyncio
 
 @dataclass
@@ -27,7 +27,7 @@ class HTTPResponseData:
     timestamp: float = field(default_factory=time.time)
 
 
-@dataclass
+@dataclass(slots=True)
 class PendingResponse:
     """待处理响应"""
     future: asyncio.Future[Any]
@@ -36,6 +36,12 @@ class PendingResponse:
     session_id: Optional[str] = None
 
 
+class QueuedFrame(NamedTuple):
+    """SSE 队列中的已编码消息"""
+    type: str
+    payload: bytes
+
+
 @dataclass
 class SessionStats:
     """会话统计信息"""
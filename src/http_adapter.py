@@ -7,16 +7,25 @@ HTTP/HTTPS Platform Adapter for AstrBot
 
 import asyncio
 import inspect
+import itertools
 import json
+import secrets
+import sys
 import time
-import uuid
+import weakref
 from typing import Any, Dict, Optional
 from collections.abc import Coroutine
 
 import hmac
-from quart import Quart, request, jsonify, make_response
+import orjson
+from quart import Quart, Response, request
 from quart_cors import cors
 
+if sys.version_info >= (3, 11):
+    from asyncio import timeout as _timeout_cm
+else:
+    from async_timeout import timeout as _timeout_cm
+
 from astrbot.api import logger
 from astrbot.api.event import MessageChain
 from astrbot.api.message_components import Plain
@@ -34,7 +43,50 @@ from astrbot.core.platform.astr_message_event import MessageSesion
 from .constants import HTTP_MESSAGE_TYPE, HTTP_STATUS_CODE
 from .dataclasses import HTTPRequestData, PendingResponse
 from .httpmessageevent import StandardHTTPMessageEvent, StreamHTTPMessageEvent
-from .tool import Json2BMCChain
+from .tool import Json2BMCChain, json_dumps, json_loads
+
+# 常用状态码与消息类型，绑定为模块常量避免每次请求查表
+_HS_OK = HTTP_STATUS_CODE["OK"]
+_HS_BAD = HTTP_STATUS_CODE["BAD_REQUEST"]
+_HS_UNAUTH = HTTP_STATUS_CODE["UNAUTHORIZED"]
+_HS_TIMEOUT = HTTP_STATUS_CODE["TIMEOUT"]
+_HS_INTERNAL = HTTP_STATUS_CODE["INTERNAL_ERROR"]
+_HS_UNAVAILABLE = HTTP_STATUS_CODE["SERVICE_UNAVAILABLE"]
+_MT_CONNECTED = HTTP_MESSAGE_TYPE["CONNECTED"]
+_MT_TIMEOUT = HTTP_MESSAGE_TYPE["TIMEOUT"]
+_MT_END = HTTP_MESSAGE_TYPE["END"]
+
+# SSE 帧的固定部分，按消息类型预先编码
+_SSE_PREFIX = {t: f"event: {t}\ndata: ".encode() for t in HTTP_MESSAGE_TYPE.values()}
+_SSE_SUFFIX = b"\n\n"
+_SSE_NORMAL_END = _SSE_PREFIX[_MT_END] + orjson.dumps({"reason": "normal_end"}) + _SSE_SUFFIX
+# 定时回调唤醒 SSE 消费者用的哨兵
+_SSE_WAKEUP = object()
+_SSE_HEADERS = (
+    ('Content-Type', 'text/event-stream'),
+    ('Cache-Control', 'no-cache'),
+    ('Connection', 'keep-alive'),
+    ('X-Accel-Buffering', 'no'),  # 禁用Nginx缓冲
+    ('X-Accel-Timeout', '1200'),  # Nginx代理超时时间
+)
+
+
+def _format_sse_encoded(event_type: str, data: bytes) -> bytes:
+    """将已编码的 JSON 字节拼接为 SSE 帧"""
+    prefix = _SSE_PREFIX.get(event_type)
+    if prefix is None:
+        prefix = f"event: {event_type}\ndata: ".encode()
+    return prefix + data + _SSE_SUFFIX
+
+
+def _format_sse_frame(event_type: str, payload: Any) -> bytes:
+    """将一条消息格式化为 SSE 帧"""
+    return _format_sse_encoded(event_type, orjson.dumps(payload))
+
+
+def _json_response(payload: Any, status: int = _HS_OK) -> Response:
+    """直接用 orjson 构建 JSON 响应，跳过 jsonify 的应用级序列化"""
+    return Response(json_dumps(payload), status=status, content_type="application/json")
 
 HTTP_ADAPTER_DEFAULT_CONFIG_TMPL = {
     "http_host": "0.0.0.0",
@@ -43,6 +95,8 @@ HTTP_ADAPTER_DEFAULT_CONFIG_TMPL = {
     "enable_http_api": True,
     "auth_token": "",
     "cors_origins": "*",
+    "max_stream_connections": 256,
+    "max_pending_responses": 1024,
 }
 
 HTTP_ADAPTER_I18N_RESOURCES = {
@@ -71,6 +125,14 @@ HTTP_ADAPTER_I18N_RESOURCES = {
             "description": "CORS 允许的源",
             "hint": "跨域请求允许的来源，多个用逗号分隔，* 表示全部允许",
         },
+        "max_stream_connections": {
+            "description": "最大流式连接数",
+            "hint": "同时处理的 SSE 流式连接上限，超出的连接返回 503，0 表示不限制",
+        },
+        "max_pending_responses": {
+            "description": "最大待处理请求数",
+            "hint": "同时等待回复的标准请求上限，超出时直接返回 503，0 表示不限制",
+        },
     },
     "en-US": {
         "http_host": {
@@ -97,6 +159,14 @@ HTTP_ADAPTER_I18N_RESOURCES = {
             "description": "CORS allowed origins",
             "hint": "Allowed origins for CORS, comma separated, * for all",
         },
+        "max_stream_connections": {
+            "description": "Max stream connections",
+            "hint": "Maximum concurrent SSE stream connections, extra connections get 503, 0 for unlimited",
+        },
+        "max_pending_responses": {
+            "description": "Max pending responses",
+            "hint": "Maximum standard requests awaiting a reply, extra requests get 503, 0 for unlimited",
+        },
     },
 }
 
@@ -131,6 +201,16 @@ HTTP_ADAPTER_CONFIG_METADATA = {
         "type": "string",
         "hint": "跨域请求允许的来源，多个用逗号分隔，* 表示全部允许",
     },
+    "max_stream_connections": {
+        "description": "最大流式连接数",
+        "type": "int",
+        "hint": "同时处理的 SSE 流式连接上限，超出的连接返回 503，0 表示不限制",
+    },
+    "max_pending_responses": {
+        "description": "最大待处理请求数",
+        "type": "int",
+        "hint": "同时等待回复的标准请求上限，超出时直接返回 503，0 表示不限制",
+    },
 }
 
 try:
@@ -175,9 +255,18 @@ class HTTPAdapter(Platform):
         self.api_prefix = platform_config.get("api_prefix", "/api/v1").rstrip("/")
         self.enable_http_api = platform_config.get("enable_http_api", True)
         self.auth_token = platform_config.get("auth_token", "")
-        self.cors_origins = platform_config.get("cors_origins", "*")
-        if isinstance(self.cors_origins, str):
-            self.cors_origins = self.cors_origins.split(",")
+        self._auth_token_bytes = self.auth_token.encode("utf-8")
+        self.max_stream_connections = int(platform_config.get("max_stream_connections", 256))
+        self.max_pending_responses = int(platform_config.get("max_pending_responses", 1024))
+
+        # 处理 CORS 来源配置
+        cors_origins_config = platform_config.get("cors_origins", "*")
+        if cors_origins_config == "*":
+            self.cors_origins = "*"
+        elif isinstance(cors_origins_config, str):
+            self.cors_origins = cors_origins_config.split(",")
+        else:
+            self.cors_origins = list(cors_origins_config)
 
         # 统计信息
         self.total_requests_processed = 0
@@ -186,20 +275,20 @@ class HTTPAdapter(Platform):
         # 会话管理
         self.pending_responses: Dict[str, PendingResponse] = {}
 
+        # 事件 ID 生成：进程内随机前缀 + 单调计数器，避免每次请求读取 os.urandom
+        self._id_prefix = secrets.token_hex(4)
+        self._id_counter = itertools.count().__next__
+
+        # 流式连接准入控制：当前占用的名额数
+        self._stream_active = 0
+
         # Quart 应用
         self.app = Quart(__name__)
 
-        # 处理 CORS 来源配置
-        cors_origins_config = platform_config.get("cors_origins", "*")
-        if cors_origins_config == "*":
-            cors_origins_list = "*"
-        else:
-            cors_origins_list = cors_origins_config.split(",") if isinstance(cors_origins_config, str) else cors_origins_config
-
         # 添加 CORS 支持 - 使用更全面的配置
         self.app = cors(
             self.app,
-            allow_origin=cors_origins_list,
+            allow_origin=self.cors_origins,
             allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
             allow_headers=["Content-Type", "Authorization", "Accept", "X-Request-ID", "Origin"],
             allow_credentials=False,
@@ -221,6 +310,7 @@ class HTTPAdapter(Platform):
             support_streaming_message=True,
             support_proactive_message=False,
         )
+        self._self_id_str = str(self._metadata.id)
 
         self._background_tasks = set() # 用于追踪任务
         
@@ -234,24 +324,61 @@ class HTTPAdapter(Platform):
         task.add_done_callback(self._background_tasks.discard)
         return task
 
-    def _set_future_exception_safely(
+    def _new_event_id(self) -> str:
+        """生成进程内唯一的事件 ID"""
+        return f"{self._id_prefix}{self._id_counter():x}"
+
+    def _build_abm(
         self,
-        fut: asyncio.Future,
-        exc: BaseException,
-    ) -> None:
+        user_id: Any,
+        nickname: str,
+        session_id: str,
+        message_id: Any,
+        message: Any,
+        messages: list,
+        data: dict,
+        timestamp: float,
+    ) -> AstrBotMessage:
+        """构建消息对象"""
+        abm = AstrBotMessage()
+        abm.self_id = self._self_id_str
+        abm.sender = MessageMember(
+            user_id=str(user_id),
+            nickname=nickname,
+        )
+        abm.type = MessageType.GROUP_MESSAGE
+        abm.session_id = session_id
+        abm.message_id = message_id
+        abm.message = messages
+        abm.message_str = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
+        abm.raw_message = data
+        abm.timestamp = int(timestamp)
+        return abm
+
+    def _pending_full(self) -> bool:
+        """待处理的标准请求是否已达上限"""
+        return 0 < self.max_pending_responses <= len(self.pending_responses)
+
+    def _try_acquire_stream_slot(self) -> bool:
+        """尝试占用一个流式连接名额，已达上限时返回 False"""
+        if 0 < self.max_stream_connections <= self._stream_active:
+            return False
+        self._stream_active += 1
+        return True
+
+    def _release_stream_slot(self) -> None:
+        """释放流式连接名额"""
+        self._stream_active -= 1
+
+    def _cancel_future_safely(self, fut: asyncio.Future, msg: Optional[str] = None) -> None:
         try:
             loop = fut.get_loop()
         except Exception:
             loop = None
 
         def _do_set() -> None:
-            if fut.done():
-                return
-            try:
-                fut.set_exception(exc)
-            except asyncio.InvalidStateError:
-                # Future was completed concurrently; ignore.
-                pass
+            # cancel() 对已完成的 Future 是空操作，无需额外处理并发完成
+            fut.cancel(msg)
 
         if loop is None:
             _do_set()
@@ -282,11 +409,9 @@ class HTTPAdapter(Platform):
         @self.app.route('/<path:path>', methods=['OPTIONS'])
         async def options_handler(path):
             """处理所有 OPTIONS 预检请求"""
-            response = await make_response('')
-            response.status_code = HTTP_STATUS_CODE["OK"]
-
-            # quart-cors 会自动处理 CORS 头部，我们只需要返回空响应
-            return response
+            # quart-cors 会自动处理 CORS 头部，我们只需要返回空响应；
+            # 直接返回 (body, status) 元组，由 Quart 构造响应，省去 make_response 的 await
+            return b'', _HS_OK
 
         # 健康检查
         @self.app.route(f'{self.api_prefix}/health', methods=['GET'])
@@ -294,11 +419,12 @@ class HTTPAdapter(Platform):
             auth_result = await self._check_auth(request)
             if auth_result is not None:
                 return auth_result
-            return jsonify({
+            return _json_response({
                 "status": "ok",
                 "service": "astrbot_http_adapter",
                 "timestamp": time.time(),
                 "pending_responses": len(self.pending_responses),
+                "stream_connections": self._stream_active,
                 "version": "1.0.0"
             })
 
@@ -307,7 +433,7 @@ class HTTPAdapter(Platform):
         async def send_message():
             """发送消息到 AstrBot"""
             if request.method == 'OPTIONS':
-                return '', HTTP_STATUS_CODE["OK"]
+                return '', _HS_OK
             return await self._handle_http_message(request)
 
         # 流式消息接口
@@ -315,7 +441,7 @@ class HTTPAdapter(Platform):
         async def send_message_stream():
             """流式发送消息到 AstrBot"""
             if request.method == 'OPTIONS':
-                return '', HTTP_STATUS_CODE["OK"]
+                return '', _HS_OK
             return await self._handle_http_stream_message(request)
 
     async def _handle_http_message(self, request_obj) -> Any:
@@ -324,15 +450,22 @@ class HTTPAdapter(Platform):
         auth_result = await self._check_auth(request_obj)
         if auth_result is not None:
             return auth_result
+        # 待处理请求达到上限时直接拒绝，避免 pending_responses 无限增长（预检，读取请求体前）
+        if self._pending_full():
+            return _json_response({"error": "待处理请求过多，请稍后重试"}, _HS_UNAVAILABLE)
+        # 本次请求统一使用同一个时间戳
+        now = time.time()
         future = None
         event_id = None
         try:
             # 获取请求数据
-            data = await request_obj.get_json()
+            raw = await request_obj.get_data(cache=False)
+            data = json_loads(raw) if raw else None
             if not data:
-                return jsonify({"error": "无效的请求数据"}), HTTP_STATUS_CODE["BAD_REQUEST"]
+                return _json_response({"error": "无效的请求数据"}, _HS_BAD)
 
             # 收集请求头信息
+            # 在边界处转换一次为 dict，extra 与事件直接复用该副本
             headers = dict(request_obj.headers)
             request_data = HTTPRequestData(
                 method=request_obj.method,
@@ -341,13 +474,14 @@ class HTTPAdapter(Platform):
                 remote_addr=request_obj.remote_addr,
                 user_agent=request_obj.user_agent.string if request_obj.user_agent else None,
                 content_type=request_obj.content_type,
-                accept=request_obj.headers.get('Accept')
+                accept=request_obj.headers.get('Accept'),
+                timestamp=now,
             )
 
             # 必需参数检查
             message = data.get('message', None)
             if not message:
-                return jsonify({"error": "message 参数是必需的"}), HTTP_STATUS_CODE["BAD_REQUEST"]
+                return _json_response({"error": "message 参数是必需的"}, _HS_BAD)
             messages = None
             if isinstance(message, list):
                 messages = Json2BMCChain(message)
@@ -357,33 +491,32 @@ class HTTPAdapter(Platform):
             nickname = data.get('nickname', '外部用户')
             session_id = str(data.get("session_id") or f"{platform}_{user_id}")
 
+            # 读取请求体期间可能有其他请求已登记，登记前再次检查；此处到写入之间没有 await
+            if self._pending_full():
+                return _json_response({"error": "待处理请求过多，请稍后重试"}, _HS_UNAVAILABLE)
+
             # 创建事件并提交
-            event_id = str(uuid.uuid4())
+            event_id = self._new_event_id()
             loop = asyncio.get_running_loop()
             future = loop.create_future()
             self.pending_responses[event_id] = PendingResponse(
                 future=future,
                 session_id=session_id,
-                timeout=data.get('timeout', 30)
+                timeout=data.get('timeout', 30),
+                created_at=now,
             )
 
             # 创建消息对象
-            abm = AstrBotMessage()
-            abm.self_id = str(self._metadata.id)
-            abm.sender = MessageMember(
-                user_id=str(user_id),
+            abm = self._build_abm(
+                user_id=user_id,
                 nickname=nickname,
+                session_id=session_id,
+                message_id=data['message_id'] if 'message_id' in data else self._new_event_id(),
+                message=message,
+                messages=[Plain(text=message)] if messages is None else messages,
+                data=data,
+                timestamp=now,
             )
-            abm.type = MessageType.GROUP_MESSAGE
-            abm.session_id = session_id
-            abm.message_id = data.get('message_id', str(uuid.uuid4().hex))
-            if messages is None:
-                abm.message = [Plain(text=message)]
-            else:
-                abm.message = messages
-            abm.message_str = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
-            abm.raw_message = data
-            abm.timestamp = int(time.time())
 
             # 创建事件
             event = StandardHTTPMessageEvent(
@@ -421,7 +554,9 @@ class HTTPAdapter(Platform):
                 if timeout < 0:
                     logger.error(f"[HTTPAdapter] timeout:{timeout} < 0 使用 30")
                     timeout = 30
-                response = await asyncio.wait_for(future, timeout=timeout)
+                # 超时上下文只注册一个定时回调，不像 wait_for 那样额外包装等待对象
+                async with _timeout_cm(timeout):
+                    response = await future
 
                 # 构建响应
                 response_data = {
@@ -436,28 +571,30 @@ class HTTPAdapter(Platform):
                 if 'message_id' in data:
                     response_data['message_id'] = data['message_id']
 
-                return jsonify(response_data)
+                return _json_response(response_data)
 
             except asyncio.TimeoutError:
-                if event_id in self.pending_responses:
-                    self.pending_responses.pop(event_id, None)
-                return jsonify({
+                # pending_responses 的清理统一交给 finally
+                return _json_response({
                     "error": "请求超时",
                     "event_id": event_id
-                }), HTTP_STATUS_CODE["TIMEOUT"]
+                }, _HS_TIMEOUT)
 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             self.total_errors += 1
-            return jsonify({"error": "无效的 JSON 数据"}), HTTP_STATUS_CODE["BAD_REQUEST"]
+            return _json_response({"error": "无效的 JSON 数据"}, _HS_BAD)
         except Exception as e:
             self.total_errors += 1
             if future and not future.done():
                 future.set_exception(e)
             logger.error(f"[HTTPAdapter] 处理HTTP请求时出错: {e}", exc_info=True)
-            return jsonify({"error": f"内部服务器错误: {str(e)}"}), HTTP_STATUS_CODE["INTERNAL_ERROR"]
+            return _json_response({"error": f"内部服务器错误: {str(e)}"}, _HS_INTERNAL)
         finally:
             if not event_id is None:
                 self.pending_responses.pop(event_id, None)
+            # 请求结束（包括客户端断开导致的取消）时不再保留未完成的 Future
+            if future is not None and not future.done():
+                future.cancel()
 
     async def _handle_http_stream_message(self, request_obj) -> Any:
         """处理 HTTP 流式消息请求 - 修复版，支持多条消息"""
@@ -465,15 +602,31 @@ class HTTPAdapter(Platform):
         auth_result = await self._check_auth(request_obj)
         if auth_result is not None:
             return auth_result
+        # 流式连接准入控制：在发送响应头、创建队列和事件之前拒绝超限连接
+        if not self._try_acquire_stream_slot():
+            return _json_response({"error": "流式连接数已达上限，请稍后重试"}, _HS_UNAVAILABLE)
+        slot_released = False
+
+        def release_slot():
+            # 幂等：生成器结束、生成器未启动即被回收、请求提前返回都会走到这里
+            nonlocal slot_released
+            if not slot_released:
+                slot_released = True
+                self._release_stream_slot()
+
+        body = None
+        # 本次请求统一使用同一个时间戳
+        now = time.time()
 
         try:
-            data = await request_obj.get_json()
+            raw = await request_obj.get_data(cache=False)
+            data = json_loads(raw) if raw else None
             if not data:
-                return jsonify({"error": "无效的请求数据"}), HTTP_STATUS_CODE["BAD_REQUEST"]
+                return _json_response({"error": "无效的请求数据"}, _HS_BAD)
 
             message = data.get('message')
             if not message:
-                return jsonify({"error": "message 参数是必需的"}), HTTP_STATUS_CODE["BAD_REQUEST"]
+                return _json_response({"error": "message 参数是必需的"}, _HS_BAD)
             if isinstance(message, list):
                 messages = Json2BMCChain(message)
             else:
@@ -481,6 +634,7 @@ class HTTPAdapter(Platform):
                 from astrbot.api.message_components import Plain
                 messages = [Plain(text=str(message))]
             # 收集请求头信息
+            # 在边界处转换一次为 dict，extra 与事件直接复用该副本
             headers = dict(request_obj.headers)
             request_data = HTTPRequestData(
                 method=request_obj.method,
@@ -489,7 +643,8 @@ class HTTPAdapter(Platform):
                 remote_addr=request_obj.remote_addr,
                 user_agent=request_obj.user_agent.string if request_obj.user_agent else None,
                 content_type=request_obj.content_type,
-                accept=request_obj.headers.get('Accept')
+                accept=request_obj.headers.get('Accept'),
+                timestamp=now,
             )
 
             platform = data.get('platform', "")
@@ -499,162 +654,197 @@ class HTTPAdapter(Platform):
 
             # 创建 SSE 响应生成器
             async def generate():
-                event_id = str(uuid.uuid4())
-                queue = asyncio.Queue(maxsize=100)  # 增加队列大小
-
-                # 创建消息对象
-                abm = AstrBotMessage()
-                abm.self_id = str(self._metadata.id)
-                abm.sender = MessageMember(
-                    user_id=str(user_id),
-                    nickname=username,
-                )
-                abm.type = MessageType.GROUP_MESSAGE
-                abm.session_id = session_id
-                abm.message_id = str(uuid.uuid4().hex)
-                abm.message = messages
-                abm.message_str = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
-                abm.raw_message = data
-                abm.timestamp = int(time.time())
-
-                # 创建事件
-                event = StreamHTTPMessageEvent(
-                    message_str=message,
-                    message_obj=abm,
-                    platform_meta=self._metadata,
-                    session_id=session_id,
-                    adapter=self,
-                    queue=queue,
-                    event_id=event_id,
-                    request_data=request_data
-                )
-
-                # 设置额外信息
-                event.set_extra("data", data)
-
-                event.is_wake = True
-                event.is_at_or_wake_command = True
-
-                # 提交事件
-                self.commit_event(event)
-
-                # 更新统计
-                self.total_requests_processed += 1
-
-                # 生成 SSE 流
-                yield f"event: {HTTP_MESSAGE_TYPE['CONNECTED']}\ndata: {json.dumps({'event_id': event_id, 'session_id': session_id})}\n\n"
-
-                # 设置超时参数
-                timeout = data.get('timeout', 600)  # 增加到10分钟，支持长对话
-                if not isinstance(timeout, int):
-                    logger.error(f"[HTTPAdapter] 不兼容的 timeout:{timeout} 尝试转变为 int")
-                    try:
-                        timeout = int(timeout)
-                    except:
-                        logger.error(f"[HTTPAdapter] 转变为 int 失败,使用 600")
+                try:
+                    # 热循环内使用局部变量
+                    mt_end = _MT_END
+                    format_encoded = _format_sse_encoded
+                    event_id = self._new_event_id()
+                    queue = asyncio.Queue(maxsize=100)  # 增加队列大小
+
+                    # 创建消息对象
+                    abm = self._build_abm(
+                        user_id=user_id,
+                        nickname=username,
+                        session_id=session_id,
+                        message_id=self._new_event_id(),
+                        message=message,
+                        messages=messages,
+                        data=data,
+                        timestamp=now,
+                    )
+
+                    # 创建事件
+                    event = StreamHTTPMessageEvent(
+                        message_str=message,
+                        message_obj=abm,
+                        platform_meta=self._metadata,
+                        session_id=session_id,
+                        adapter=self,
+                        queue=queue,
+                        event_id=event_id,
+                        request_data=request_data
+                    )
+
+                    # 设置额外信息
+                    event.set_extra("data", data)
+
+                    event.is_wake = True
+                    event.is_at_or_wake_command = True
+
+                    # 提交事件
+                    self.commit_event(event)
+
+                    # 更新统计
+                    self.total_requests_processed += 1
+
+                    # 生成 SSE 流
+                    yield _format_sse_frame(_MT_CONNECTED, {'event_id': event_id, 'session_id': session_id})
+
+                    # 设置超时参数
+                    timeout = data.get('timeout', 600)  # 增加到10分钟，支持长对话
+                    if not isinstance(timeout, int):
+                        logger.error(f"[HTTPAdapter] 不兼容的 timeout:{timeout} 尝试转变为 int")
+                        try:
+                            timeout = int(timeout)
+                        except:
+                            logger.error(f"[HTTPAdapter] 转变为 int 失败,使用 600")
+                            timeout = 600
+                    if timeout < 0:
+                        logger.error(f"[HTTPAdapter] timeout:{timeout} < 0 使用 600")
                         timeout = 600
-                if timeout < 0:
-                    logger.error(f"[HTTPAdapter] timeout:{timeout} < 0 使用 600")
-                    timeout = 600
-                heartbeat_interval = data.get("heartbeat_interval", 10)
-                if not isinstance(heartbeat_interval, int):
-                    try:
-                        heartbeat_interval = int(heartbeat_interval)
-                    except Exception:
+                    heartbeat_interval = data.get("heartbeat_interval", 10)
+                    if not isinstance(heartbeat_interval, int):
+                        try:
+                            heartbeat_interval = int(heartbeat_interval)
+                        except Exception:
+                            heartbeat_interval = 10
+                    if heartbeat_interval <= 0:
                         heartbeat_interval = 10
-                if heartbeat_interval <= 0:
-                    heartbeat_interval = 10
-
-                start_time = time.time()
-                last_activity_time = time.time()
-                received_end_event = False
 
-                try:
-                    while not received_end_event:
-                        # 检查总超时
-                        current_time = time.time()
-                        if current_time - start_time > timeout:
-                            yield (
-                                f"event: {HTTP_MESSAGE_TYPE['TIMEOUT']}\n"
-                                f"data: {json.dumps({'reason': 'total_timeout', 'duration': current_time - start_time})}\n\n"
-                            )
-                            break
-
-                        # 检查活动超时（60秒无活动发送心跳）
-                        if current_time - last_activity_time > heartbeat_interval:
-                            # 发送心跳保持连接
-                            yield f": heartbeat {int(current_time)}\n\n"
-                            last_activity_time = current_time
+                    loop = asyncio.get_running_loop()
+                    start_time = loop.time()
+                    last_activity_time = start_time
+                    received_end_event = False
+                    timed_out = False
+                    heartbeat_due = False
 
+                    def wake_consumer():
+                        # 队列已满时消费者必然会很快醒来并检查标志，无需再入队
                         try:
-                            # 等待队列消息，使用短超时以便检查其他条件
-                            item = await asyncio.wait_for(queue.get(), timeout=1.0)
-
-                            try:
-                                if item is None:
-                                    # None 是特殊的结束信号
-                                    yield (
-                                        f"event: {HTTP_MESSAGE_TYPE['END']}\n"
-                                        f"data: {json.dumps({'reason': 'normal_end'})}\n\n"
-                                    )
-                                    received_end_event = True
-                                    break
+                            queue.put_nowait(_SSE_WAKEUP)
+                        except asyncio.QueueFull:
+                            pass
+
+                    def on_timeout():
+                        nonlocal timed_out
+                        timed_out = True
+                        wake_consumer()
+
+                    def on_heartbeat():
+                        nonlocal heartbeat_due, heartbeat_handle
+                        idle = loop.time() - last_activity_time
+                        if idle >= heartbeat_interval:
+                            heartbeat_due = True
+                            wake_consumer()
+                            idle = 0
+                        heartbeat_handle = loop.call_later(heartbeat_interval - idle, on_heartbeat)
+
+                    # 总超时与心跳由定时回调驱动，队列等待不再需要超时轮询
+                    timeout_handle = loop.call_at(start_time + timeout, on_timeout)
+                    heartbeat_handle = loop.call_later(heartbeat_interval, on_heartbeat)
 
-                                # 处理事件
-                                event_type = item.get('type')
+                    try:
+                        while True:
+                            # 等待队列消息
+                            item = await queue.get()
+
+                            # 每次唤醒时取空队列中已有的消息，合并为一次输出
+                            frames = []
+                            while True:
+                                try:
+                                    if item is None:
+                                        # None 是特殊的结束信号
+                                        frames.append(_SSE_NORMAL_END)
+                                        received_end_event = True
+                                        break
+
+                                    if item is not _SSE_WAKEUP:
+                                        # 处理事件：生产端已完成 JSON 编码
+                                        event_type = item.type
+
+                                        frames.append(format_encoded(event_type, item.payload))
+
+                                        # 如果是 end 事件，结束循环
+                                        if event_type == mt_end:
+                                            received_end_event = True
+                                            break
+                                finally:
+                                    queue.task_done()
+
+                                try:
+                                    item = queue.get_nowait()
+                                except asyncio.QueueEmpty:
+                                    break
 
+                            if frames:
                                 # 更新最后活动时间
-                                last_activity_time = time.time()
+                                last_activity_time = loop.time()
 
                                 # 发送事件
-                                yield (
-                                    f"event: {item.get('type')}\n"
-                                    f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
+                                yield b"".join(frames)
+
+                            if received_end_event:
+                                break
+
+                            # 检查总超时
+                            if timed_out:
+                                yield _format_sse_frame(
+                                    _MT_TIMEOUT,
+                                    {'reason': 'total_timeout', 'duration': loop.time() - start_time},
                                 )
+                                break
 
-                                # 如果是 end 事件，结束循环
-                                if event_type == HTTP_MESSAGE_TYPE['END']:
-                                    received_end_event = True
-                                    break
-                            finally:
-                                queue.task_done()
-
-                        except asyncio.TimeoutError:
-                            # 超时是正常的，继续循环检查其他条件
-                            continue
-
-                except asyncio.CancelledError:
-                    # 连接被取消
-                    logger.info(f"[HTTPAdapter] SSE连接被取消: {event_id}")
-                except Exception as e:
-                    logger.error(f"[HTTPAdapter] 生成SSE时出错: {e}", exc_info=True)
-                finally:
-                    # 通知事件停止生成
-                    try:
-                        queue.put_nowait(None)
+                            # 无活动时发送心跳保持连接
+                            if heartbeat_due:
+                                heartbeat_due = False
+                                yield f": heartbeat {int(time.time())}\n\n".encode()
+                                last_activity_time = loop.time()
+
+                    except asyncio.CancelledError:
+                        # 连接被取消
+                        logger.info(f"[HTTPAdapter] SSE连接被取消: {event_id}")
                     except Exception as e:
-                        logger.error(f"[HTTPAdapter] SSE发送结束信号时错误: {e}", exc_info=True)
-                    if hasattr(event, "_is_streaming"):
-                        event._is_streaming = False
-                    logger.info(f"[HTTPAdapter] SSE连接结束: {event_id}, 会话: {session_id}")
+                        logger.error(f"[HTTPAdapter] 生成SSE时出错: {e}", exc_info=True)
+                    finally:
+                        timeout_handle.cancel()
+                        heartbeat_handle.cancel()
 
-            headers = {
-                'Content-Type': 'text/event-stream',
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no',  # 禁用Nginx缓冲
-                'X-Accel-Timeout': '1200',  # Nginx代理超时时间
-            }
+                        # 通知事件停止生成
+                        try:
+                            queue.put_nowait(None)
+                        except Exception as e:
+                            logger.error(f"[HTTPAdapter] SSE发送结束信号时错误: {e}", exc_info=True)
+                        event._is_streaming = False
+                        logger.info(f"[HTTPAdapter] SSE连接结束: {event_id}, 会话: {session_id}")
+                finally:
+                    release_slot()
 
-            return generate(), HTTP_STATUS_CODE["OK"], headers
+            body = generate()
+            # 客户端在响应体开始迭代前断开时生成器的 finally 不会执行，回收时兜底释放名额
+            weakref.finalize(body, release_slot)
+            return Response(body, status=_HS_OK, headers=_SSE_HEADERS)
 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             self.total_errors += 1
-            return jsonify({"error": "无效的 JSON 数据"}), HTTP_STATUS_CODE["BAD_REQUEST"]
+            return _json_response({"error": "无效的 JSON 数据"}, _HS_BAD)
         except Exception as e:
             self.total_errors += 1
             logger.error(f"[HTTPAdapter] 处理流式请求时出错: {e}", exc_info=True)
-            return jsonify({"error": f"内部服务器错误: {str(e)}"}), HTTP_STATUS_CODE["INTERNAL_ERROR"]
+            return _json_response({"error": f"内部服务器错误: {str(e)}"}, _HS_INTERNAL)
+        finally:
+            # 未交给响应体的名额在此释放
+            if body is None:
+                release_slot()
 
     async def _check_auth(self, request_obj) -> Optional[Any]:
         """检查鉴权"""
@@ -663,13 +853,23 @@ class HTTPAdapter(Platform):
 
         auth_header = request_obj.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({"error": "未授权访问"}), HTTP_STATUS_CODE["UNAUTHORIZED"]
+            return _json_response({"error": "未授权访问"}, _HS_UNAUTH)
+
+        # 服务器按 latin-1 解码请求头，用 latin-1 还原客户端发送的原始字节，
+        # 与按 UTF-8 编码的配置令牌比较，非 ASCII 令牌也能正确匹配
+        try:
+            token = auth_header[7:].encode("latin-1")
+        except UnicodeEncodeError:
+            return _json_response({"error": "无效的令牌"}, _HS_UNAUTH)
 
-        token = auth_header[7:]
+        # 长度不同时直接拒绝，只有等长令牌才需要常量时间比较
+        if len(token) != len(self._auth_token_bytes):
+            return _json_response({"error": "无效的令牌"}, _HS_UNAUTH)
 
-        # 使用 hmac.compare_digest 进行安全的字符串比较
-        if not hmac.compare_digest(token, self.auth_token):
-            return jsonify({"error": "无效的令牌"}), HTTP_STATUS_CODE["UNAUTHORIZED"]
+        # 使用 hmac.compare_digest 进行安全的比较
+        # 以 bytes 比较：str 含非 ASCII 字符时 compare_digest 会抛出 TypeError
+        if not hmac.compare_digest(token, self._auth_token_bytes):
+            return _json_response({"error": "无效的令牌"}, _HS_UNAUTH)
 
         return None
 
@@ -710,7 +910,9 @@ class HTTPAdapter(Platform):
             config.use_reloader = False
             # 禁用 Hypercorn 的信号处理，让我们自己处理
             config.signal_handlers = False
-            
+            # 不再为每个响应格式化 Server 头
+            config.include_server_header = False
+
             await hypercorn.asyncio.serve(self.app, config, shutdown_trigger=self.shutdown_event.wait)
 
         except Exception as e:
@@ -727,7 +929,8 @@ class HTTPAdapter(Platform):
 
         # 取消并等待后台任务
         if self._background_tasks:
-            for task in list(self._background_tasks):
+            # cancel() 只会调度 done_callback，迭代期间集合不会变化，无需快照
+            for task in self._background_tasks:
                 task.cancel()
 
             await asyncio.gather(
@@ -739,9 +942,8 @@ class HTTPAdapter(Platform):
 
         # 取消所有等待中的响应
         if self.pending_responses:
-            exc = asyncio.CancelledError("适配器终止")
-            for event_id, pending in list(self.pending_responses.items()):
-                self._set_future_exception_safely(pending.future, exc)
+            for pending in self.pending_responses.values():
+                self._cancel_future_safely(pending.future, "适配器终止")
 
             self.pending_responses.clear()
 
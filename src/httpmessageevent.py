@@ -2,19 +2,36 @@ import asyncio
 import sys
 import time
 from collections.abc import AsyncGenerator
+from operator import attrgetter
 
+import orjson
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent, MessageChain
+from astrbot.api.message_components import Plain
 
 from .constants import HTTP_EVENT_TYPE, HTTP_MESSAGE_TYPE
-from .dataclasses import HTTPRequestData
-from .tool import BMC2Dict
+from .dataclasses import HTTPRequestData, QueuedFrame
+from .tool import BMC2Dict, json_dumps
+
+# 常用消息/事件类型，绑定为模块常量避免每条消息查表
+_MSG_TYPE_MESSAGE = HTTP_MESSAGE_TYPE["MESSAGE"]
+_MSG_TYPE_END = HTTP_MESSAGE_TYPE["END"]
+_MSG_TYPE_ERROR = HTTP_MESSAGE_TYPE["ERROR"]
+_MSG_TYPE_TIMEOUT = HTTP_MESSAGE_TYPE["TIMEOUT"]
+_EVENT_TYPE_HTTP_REQUEST = HTTP_EVENT_TYPE["HTTP_REQUEST"]
+# 队列拥塞时仍需强制送达的消息类型
+_CRITICAL_MSG_TYPES = frozenset({_MSG_TYPE_END, _MSG_TYPE_ERROR, _MSG_TYPE_TIMEOUT})
+
+# 入队的消息在生产端即编码为 QueuedFrame，消费端只需拼接 SSE 帧
+_END_FRAME = QueuedFrame(_MSG_TYPE_END, orjson.dumps({"type": _MSG_TYPE_END, "data": {}}))
 
 # NOTE: When core agent processing hits an exception, AstrBot calls `event.send(...)`
 # inside `agent_sub_stages/internal.py`'s exception handler but does not guarantee a
 # final END signal for HTTP streaming / future-based HTTP responses. We detect that
 # context and auto-finalize to prevent hung requests.
 _INTERNAL_AGENT_SUBSTAGE_FILE_FRAGMENT = "agent_sub_stages/internal.py"
+# 向上查找的最大帧数；异常处理器直接调用 send，无需遍历整个调用栈
+_INTERNAL_AGENT_MAX_FRAMES = 64
 
 
 def _is_internal_agent_exception_context() -> bool:
@@ -26,12 +43,15 @@ def _is_internal_agent_exception_context() -> bool:
     except (AttributeError, ValueError):
         return False
 
-    while frame is not None:
+    for _ in range(_INTERNAL_AGENT_MAX_FRAMES):
+        if frame is None:
+            break
         try:
-            filename = frame.f_code.co_filename.replace("\\", "/")
+            code = frame.f_code
+            # 先比较函数名，只有名为 process 的帧才需要规范化文件路径
             if (
-                _INTERNAL_AGENT_SUBSTAGE_FILE_FRAGMENT in filename
-                and frame.f_code.co_name == "process"
+                code.co_name == "process"
+                and _INTERNAL_AGENT_SUBSTAGE_FILE_FRAGMENT in code.co_filename.replace("\\", "/")
             ):
                 return True
         except Exception:
@@ -44,6 +64,23 @@ def _is_internal_agent_exception_context() -> bool:
 class HTTPMessageEvent(AstrMessageEvent):
     """HTTP 消息事件基类"""
 
+    # 父类 AstrMessageEvent 仍带 __dict__，这里仅把本类自有的属性放入槽位
+    __slots__ = ("_adapter", "event_id", "http_request_data", "_raw_headers")
+
+    # 从 HTTPRequestData 透传到 extra 的字段：(extra 键, 请求数据属性)
+    _EXTRA_ATTRS = (
+        ("request_method", "method"),
+        ("request_url", "url"),
+        ("request_headers", "headers"),
+        ("remote_addr", "remote_addr"),
+        ("user_agent", "user_agent"),
+        ("content_type", "content_type"),
+        ("accept", "accept"),
+        ("request_timestamp", "timestamp"),
+    )
+    _EXTRA_KEYS = tuple(key for key, _ in _EXTRA_ATTRS)
+    _EXTRA_GETTER = attrgetter(*(attr for _, attr in _EXTRA_ATTRS))
+
     def __init__(self, message_str, message_obj, platform_meta, session_id, adapter, event_id, request_data):
         # 调用父类初始化
         super().__init__(message_str, message_obj, platform_meta, session_id)
@@ -63,17 +100,12 @@ class HTTPMessageEvent(AstrMessageEvent):
 
     def _set_extra_info(self, request_data: HTTPRequestData):
         """设置额外信息"""
-        self.set_extra("event_id", self.event_id)
-        self.set_extra("event_type", HTTP_EVENT_TYPE["HTTP_REQUEST"])
-        self.set_extra("http_request", True)
-        self.set_extra("request_method", request_data.method)
-        self.set_extra("request_url", request_data.url)
-        self.set_extra("request_headers", dict(request_data.headers))
-        self.set_extra("remote_addr", request_data.remote_addr)
-        self.set_extra("user_agent", request_data.user_agent)
-        self.set_extra("content_type", request_data.content_type)
-        self.set_extra("accept", request_data.accept)
-        self.set_extra("request_timestamp", request_data.timestamp)
+        set_extra = self.set_extra
+        set_extra("event_id", self.event_id)
+        set_extra("event_type", _EVENT_TYPE_HTTP_REQUEST)
+        set_extra("http_request", True)
+        for key, value in zip(self._EXTRA_KEYS, self._EXTRA_GETTER(request_data)):
+            set_extra(key, value)
 
     @property
     def adapter(self):
@@ -109,32 +141,37 @@ class StandardHTTPMessageEvent(HTTPMessageEvent):
     特点：send方法只缓存数据，不立即返回响应；由 on_llm_response 统一输出
     """
 
+    __slots__ = ("_cached_response", "_finalcall", "_has_send_oper")
+
     def __init__(self, message_str, message_obj, platform_meta, session_id, adapter, event_id, request_data):
         super().__init__(message_str, message_obj, platform_meta, session_id, adapter, event_id, request_data)
         self._cached_response = []  # 缓存完整的响应数据
         self._finalcall = False
+        self._has_send_oper = False
 
     async def send(self, message_chain: MessageChain):
         """
         缓存消息链数据，不立即发送响应
         """
-        # 处理消息链
+        # 处理消息链并缓存
         self._has_send_oper = True
-        full_response = []
-        for message in message_chain.chain:
-            response_json, text_type = BMC2Dict(message)
-            full_response.append({
-                "content": response_json,
-                "type": text_type
-            })
-
-        # 如果没有消息，返回空数组
-        if not full_response:
-            full_response = []
-
-        # 缓存完整的响应数据
-        self._cached_response.extend(full_response)
-        logger.debug(f"[StandardHTTPMessageEvent] 已缓存响应数据 (event_id: {self.event_id}, 消息数: {len(full_response)})")
+        count = self._cache_chain(message_chain)
+        await self._after_cached(count)
+
+    def _cache_chain(self, message_chain: MessageChain) -> int:
+        """将消息链逐条转换后直接追加到缓存，返回追加的消息数"""
+        chain = message_chain.chain
+        if not chain:
+            return 0
+        self._cached_response.extend([
+            {"content": response_json, "type": text_type}
+            for response_json, text_type in map(BMC2Dict, chain)
+        ])
+        return len(chain)
+
+    async def _after_cached(self, count: int):
+        """缓存完成后的收尾：异常上下文或已标记最终调用时发送响应"""
+        logger.debug("[StandardHTTPMessageEvent] 已缓存响应数据 (event_id: %s, 消息数: %d)", self.event_id, count)
 
         if _is_internal_agent_exception_context():
             await self.send_response()
@@ -151,24 +188,20 @@ class StandardHTTPMessageEvent(HTTPMessageEvent):
             use_fallback: bool = False,
     ):
         """
-        获取完所有流式数据后，一次性缓存
+        边接收流式数据边转换缓存，全部接收后统一收尾
         """
-        # 收集所有流式数据
-        collected_chains = []
+        received = False
+        count = 0
         async for chain in generator:
-            collected_chains.append(chain)
+            received = True
+            count += self._cache_chain(chain)
 
-        # 如果没有收集到任何数据，直接返回
-        if not collected_chains:
+        # 如果没有收到任何数据，直接返回
+        if not received:
             return None
 
-        # 合并所有消息链
-        merged_chain = MessageChain()
-        for chain in collected_chains:
-            merged_chain.chain.extend(chain.chain)
-
-        # 一次性缓存合并后的消息
-        await self.send(merged_chain)
+        self._has_send_oper = True
+        await self._after_cached(count)
 
         return None
 
@@ -181,9 +214,7 @@ class StandardHTTPMessageEvent(HTTPMessageEvent):
             self._cached_response = []
 
         # 获取待处理响应
-        pending = None
-        if self.event_id in self._adapter.pending_responses:
-            pending = self._adapter.pending_responses.pop(self.event_id)
+        pending = self._adapter.pending_responses.pop(self.event_id, None)
 
         # 设置响应结果
         if pending and not pending.future.done():
@@ -217,7 +248,11 @@ class StandardHTTPMessageEvent(HTTPMessageEvent):
             else:
                 _do_set_result()
 
-            logger.debug(f"[StandardHTTPMessageEvent] 已发送响应 (event_id: {self.event_id}, 消息数: {len(self._cached_response)})")
+            logger.debug(
+                "[StandardHTTPMessageEvent] 已发送响应 (event_id: %s, 消息数: %d)",
+                self.event_id,
+                len(self._cached_response),
+            )
         else:
             logger.warning(f"[StandardHTTPMessageEvent] 没有找到待处理响应: event_id={self.event_id}")
 
@@ -225,13 +260,24 @@ class StandardHTTPMessageEvent(HTTPMessageEvent):
         self._finalcall = True
 
     def get_has_send_oper(self):
-        return getattr(self, "_has_send_oper", False)
+        return self._has_send_oper
 
 class StreamHTTPMessageEvent(HTTPMessageEvent):
     """流式 HTTP 消息事件
     特点：send方法不处理（保持不动），send_streaming方法流式发送消息（不发送结束信号）
     """
 
+    __slots__ = (
+        "queue",
+        "_queue_loop",
+        "_is_streaming",
+        "_stream_complete",
+        "_stream_complete_loop",
+        "_last_overflow_log",
+        "_finalcall",
+        "_has_send_oper",
+    )
+
     def __init__(self, message_str, message_obj, platform_meta, session_id, adapter, queue, event_id, request_data):
         super().__init__(message_str, message_obj, platform_meta, session_id, adapter, event_id, request_data)
         self.queue = queue
@@ -245,14 +291,26 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
         self._last_overflow_log = 0.0
         self.set_extra("streaming", True)
         self._finalcall = False
+        self._has_send_oper = False
 
-    def _get_stream_complete_event(self) -> asyncio.Event:
+    def _get_stream_complete_future(self) -> asyncio.Future:
         loop = asyncio.get_running_loop()
         if self._stream_complete is None or self._stream_complete_loop is not loop:
-            self._stream_complete = asyncio.Event()
+            self._stream_complete = loop.create_future()
             self._stream_complete_loop = loop
         return self._stream_complete
 
+    def _reset_stream_complete(self) -> None:
+        """开始新一轮流式传输时换用新的 Future"""
+        loop = asyncio.get_running_loop()
+        self._stream_complete = loop.create_future()
+        self._stream_complete_loop = loop
+
+    def _mark_stream_complete(self) -> None:
+        fut = self._get_stream_complete_future()
+        if not fut.done():
+            fut.set_result(None)
+
     async def send(self, message_chain: MessageChain):
         """发送完整响应 - 用于非流式输出"""
         # 发送完整消息（这将发送多条消息，但不会发送结束信号）
@@ -260,7 +318,7 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
         for message in message_chain.chain:
             response_text, text_type = BMC2Dict(message)
             success = await self._safe_put({
-                "type": HTTP_MESSAGE_TYPE["MESSAGE"],
+                "type": _MSG_TYPE_MESSAGE,
                 "data": {"content": response_text},
                 "text_type": text_type
             })
@@ -290,8 +348,7 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
         try:
             # 标记开始流式传输
             self._is_streaming = True
-            stream_complete = self._get_stream_complete_event()
-            stream_complete.clear()
+            self._reset_stream_complete()
 
             # 流式发送每个消息块
             await self.queue_put_generator(generator)
@@ -299,7 +356,7 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
 
             # 注意：这里不再发送 END 信号，只标记内部完成
             self._is_streaming = False
-            stream_complete.set()
+            self._mark_stream_complete()
 
         except Exception as e:
             logger.error(f"[StreamHTTPMessageEvent] 流式发送时出错: {e}", exc_info=True)
@@ -307,7 +364,7 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
             # 发送错误信息（错误时仍然需要通知客户端）
             try:
                 success = await self._safe_put({
-                    "type": HTTP_MESSAGE_TYPE["ERROR"],
+                    "type": _MSG_TYPE_ERROR,
                     "data": {"error": str(e)}
                 })
                 if not success:
@@ -317,7 +374,7 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
 
             # 标记流式传输完成（即使出错）
             self._is_streaming = False
-            self._get_stream_complete_event().set()
+            self._mark_stream_complete()
 
             try:
                 await self.send_end_signal()
@@ -333,11 +390,11 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
             await self.send_end_signal()
             self._finalcall = False
 
-    async def _end_streaming(self):
+    def _end_streaming(self):
         """结束当前的流式传输（内部使用，不对外发送结束信号）"""
         if self._is_streaming:
             self._is_streaming = False
-            self._get_stream_complete_event().set()
+            self._mark_stream_complete()
 
     async def send_end_signal(self):
         """
@@ -345,21 +402,17 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
         """
         # 确保流式传输已经完成
         if self._is_streaming:
-            # 等待流式传输完成（但最多等待5秒）
-            try:
-                await asyncio.wait_for(self._get_stream_complete_event().wait(), timeout=5.0)
-            except asyncio.TimeoutError:
+            # 等待流式传输完成（但最多等待5秒）；asyncio.wait 超时不会取消该 Future
+            done, _ = await asyncio.wait((self._get_stream_complete_future(),), timeout=5.0)
+            if not done:
                 logger.warning(f"[StreamHTTPMessageEvent] 等待流式完成超时 (event_id: {self.event_id})")
                 self._is_streaming = False
 
         # 发送结束信号
-        success = await self._safe_put({
-            "type": HTTP_MESSAGE_TYPE["END"],
-            "data": {}
-        })
+        success = await self._safe_put(_END_FRAME)
         if not success:
             self._is_streaming = False
-        logger.debug(f"[StreamHTTPMessageEvent] 已发送结束信号 (event_id: {self.event_id})")
+        logger.debug("[StreamHTTPMessageEvent] 已发送结束信号 (event_id: %s)", self.event_id)
 
     def set_final_call(self):
         self._finalcall = True
@@ -384,7 +437,7 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
             last_flush_time = time.monotonic()
             return await self._safe_put(
                 {
-                    "type": HTTP_MESSAGE_TYPE["MESSAGE"],
+                    "type": _MSG_TYPE_MESSAGE,
                     "data": {"content": {"type": buffer_type, "data": {"text": merged_text}}},
                     "text_type": buffer_type,
                 },
@@ -395,17 +448,23 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
             if not self._is_streaming:
                 break
             for message in message_chain.chain:
-                response_text, text_type = BMC2Dict(message)
+                if type(message) is Plain:
+                    # Plain 组件直接读取属性，跳过 BMC2Dict 的通用转换
+                    text = message.text
+                    text_type = str(message.type)
+                    response_text = {"type": "text", "data": {"text": text}}
+                    is_plain = text_type.lower() in {"plain", "text"} and isinstance(text, str)
+                else:
+                    response_text, text_type = BMC2Dict(message)
+                    text = (
+                        (response_text.get("data") or {}).get("text")
+                        if isinstance(response_text, dict) else None
+                    )
+                    is_plain = str(text_type).lower() in {"plain", "text"} and isinstance(text, str)
 
-                is_plain = (
-                    str(text_type).lower() in {"plain", "text"}
-                    and isinstance(response_text, dict)
-                    and isinstance((response_text.get("data") or {}).get("text"), str)
-                )
                 if is_plain:
                     if text_buffer_type is None:
                         text_buffer_type = str(text_type)
-                    text = (response_text.get("data") or {}).get("text")
                     text_buffer.append(text)
                     text_buffer_len += len(text)
                     now = time.monotonic()
@@ -432,7 +491,7 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
 
                 success = await self._safe_put(
                     {
-                        "type": HTTP_MESSAGE_TYPE["MESSAGE"],
+                        "type": _MSG_TYPE_MESSAGE,
                         "data": {"content": response_text},
                         "text_type": text_type,
                     },
@@ -452,9 +511,9 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
             await flush_text_buffer()
 
     def get_has_send_oper(self):
-        return getattr(self, "_has_send_oper", False)
+        return self._has_send_oper
 
-    async def _force_put(self, item: dict, timeout: float = 1.0) -> bool:
+    async def _force_put(self, item: QueuedFrame, timeout: float = 1.0) -> bool:
         deadline = time.monotonic() + timeout if timeout and timeout > 0 else time.monotonic()
 
         async def _inner() -> bool:
@@ -491,8 +550,10 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
             fut.cancel()
             return False
 
-    async def _safe_put(self, item: dict, timeout: float = 1.0) -> bool:
-        """安全入队，防止反压阻塞"""
+    async def _safe_put(self, item: dict | QueuedFrame, timeout: float = 1.0) -> bool:
+        """安全入队，防止反压阻塞；字典消息在入队前编码为 QueuedFrame"""
+        if type(item) is dict:
+            item = QueuedFrame(item["type"], json_dumps(item))
         try:
             try:
                 current_loop = asyncio.get_running_loop()
@@ -500,7 +561,11 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
                 current_loop = None
 
             if current_loop is not None and current_loop is self._queue_loop:
-                await asyncio.wait_for(self.queue.put(item), timeout=timeout)
+                try:
+                    # 队列未满时直接入队，无需挂起等待
+                    self.queue.put_nowait(item)
+                except asyncio.QueueFull:
+                    await asyncio.wait_for(self.queue.put(item), timeout=timeout)
             else:
                 try:
                     fut = asyncio.run_coroutine_threadsafe(
@@ -523,11 +588,7 @@ class StreamHTTPMessageEvent(HTTPMessageEvent):
                 )
                 self._last_overflow_log = now
 
-            if item.get("type") in {
-                HTTP_MESSAGE_TYPE["END"],
-                HTTP_MESSAGE_TYPE["ERROR"],
-                HTTP_MESSAGE_TYPE["TIMEOUT"],
-            }:
+            if item.type in _CRITICAL_MSG_TYPES:
                 return await self._force_put(item, timeout=timeout)
 
             return False
@@ -25,12 +25,16 @@ from astrbot.api.message_components import (
     WechatEmoji,
 )
 import json
-from typing import Dict, Any, List
+import re
+import orjson
+from typing import Callable, Dict, Any, List, Mapping
 from astrbot.api import logger
+from functools import lru_cache
+from types import MappingProxyType
 import inspect
 
 # 已有的 COMPONENT_TYPES 映射
-COMPONENT_TYPES = {
+COMPONENT_TYPES = MappingProxyType({
     # Basic Message Segments
     "plain": Plain,
     "text": Plain,
@@ -56,7 +60,44 @@ COMPONENT_TYPES = {
     "json": Json,
     "unknown": Unknown,
     "wechatemoji": WechatEmoji,
-}
+})
+
+def _plain_to_dict(data: Plain) -> tuple[dict[Any,Any], str]:
+    return {"type": "text", "data": {"text": data.text}}, str(data.type)
+
+# 需要特殊转换的组件类型 -> 转换函数；其余组件使用 toDict()
+_BMC2DICT_DISPATCH = MappingProxyType({
+    Plain: _plain_to_dict,
+})
+
+# ================= JSON 编解码 =================
+# orjson 不支持超出 64 位的整数（部分客户端的 QQ 号、群号、消息 ID），
+# 不同版本会报错或静默转为 float，此类输入交给标准库 json 以保持精度
+
+# 连续 19 位及以上的数字才可能超出 64 位整数范围
+_LONG_DIGITS_RE = re.compile(rb"\d{19}")
+
+def json_loads(raw: bytes) -> Any:
+    """
+    解析请求体 JSON，含超长数字时使用标准库 json 保证大整数精确
+
+    Raises:
+        orjson.JSONDecodeError: 无法解析时抛出
+    """
+    if _LONG_DIGITS_RE.search(raw) is None:
+        return orjson.loads(raw)
+    try:
+        return json.loads(raw)
+    except ValueError:
+        # 交由 orjson 抛出统一的解析异常
+        return orjson.loads(raw)
+
+def json_dumps(obj: Any) -> bytes:
+    """编码为紧凑 JSON 字节串，orjson 无法编码时回退到标准库 json"""
+    try:
+        return orjson.dumps(obj)
+    except orjson.JSONEncodeError:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
 
 # BMC类型转变为Text
 def BMC2Dict(data: BaseMessageComponent) -> tuple[dict[Any,Any], str]:
@@ -69,10 +110,129 @@ def BMC2Dict(data: BaseMessageComponent) -> tuple[dict[Any,Any], str]:
     Returns:
         tuple: (Dict, 类型字符串)
     """
-    if isinstance(data, Plain):
-        return {"type": "text", "data": {"text": data.text}}, str(data.type)
+    handler = _BMC2DICT_DISPATCH.get(type(data))
+    if handler is not None:
+        return handler(data)
     return data.toDict(), str(data.type)
 
+# ================= 特殊组件构建 =================
+# 每个函数接收 data 字段内容，返回对应组件；由 Json2BMC 按组件类查表分发
+
+def _build_plain(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    return Plain(text=data_content.get("text", ""))
+
+def _build_image(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    g = data_content.get
+    return Image(
+        file=g("file", ""),
+        url=g("url", ""),
+        path=g("path", "")
+    )
+
+def _build_record(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    g = data_content.get
+    return Record(
+        file=g("file", ""),
+        url=g("url", ""),
+        path=g("path", "")
+    )
+
+def _build_video(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    g = data_content.get
+    return Video(
+        file=g("file", ""),
+        cover=g("cover", ""),
+        path=g("path", "")
+    )
+
+def _build_file(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    g = data_content.get
+    return File(
+        name=g("name", ""),
+        file=g("file", ""),
+        url=g("url", "")
+    )
+
+def _build_at(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    g = data_content.get
+    qq = g("qq", "")
+    if qq == "all":
+        return AtAll()
+    return At(qq=qq, name=g("name", ""))
+
+def _build_reply(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    g = data_content.get
+    return Reply(
+        id=g("id", ""),
+        text=g("text", ""),
+        qq=g("qq", 0)
+    )
+
+def _build_node(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    g = data_content.get
+    content = g("content", [])
+    parsed_content = (
+        [Json2BMC(item) for item in content if isinstance(item, dict)]
+        if isinstance(content, list) else []
+    )
+
+    return Node(
+        content=parsed_content,
+        name=g("name", ""),
+        uin=g("user_id", g("uin", "0")),
+        id=g("id", 0)
+    )
+
+def _is_node_type(node_type: Any) -> bool:
+    return isinstance(node_type, str) and (node_type == "node" or node_type.lower() == "node")
+
+def _build_nodes(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    nodes = data_content.get("nodes", [])
+
+    # 只有 node 类型的子项会被保留，直接构建 Node，跳过 Json2BMC 的类型分发
+    return Nodes(nodes=[
+        _build_node(node_data.get("data") or {})
+        for node_data in nodes
+        if isinstance(node_data, dict) and _is_node_type(node_data.get("type"))
+    ])
+
+def _build_json(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    json_data = data_content.get("data", {})
+    if isinstance(json_data, str):
+        return Json(data=json_data)
+    return Json(data=json.dumps(json_data, ensure_ascii=False))
+
+def _build_poke(data_content: Dict[str, Any]) -> BaseMessageComponent:
+    g = data_content.get
+    return Poke(
+        type=g("type", ""),
+        id=g("id", 0),
+        qq=g("qq", 0)
+    )
+
+# 组件类 -> 构建函数；未列出的组件走通用安全创建
+_COMPONENT_BUILDERS: Mapping[type, Callable[[Dict[str, Any]], BaseMessageComponent]] = MappingProxyType({
+    Plain: _build_plain,
+    Image: _build_image,
+    Record: _build_record,
+    Video: _build_video,
+    File: _build_file,
+    At: _build_at,
+    Reply: _build_reply,
+    Node: _build_node,
+    Nodes: _build_nodes,
+    Json: _build_json,
+    Poke: _build_poke,
+})
+
+# 组件 __init__ 的参数信息，按组件类缓存，避免重复反射
+@lru_cache(maxsize=None)
+def _init_params(component_class: type) -> tuple[frozenset[str], bool]:
+    """返回 (可接受的参数名, 是否接受任意关键字参数)"""
+    params = inspect.signature(component_class.__init__).parameters
+    accepts_any = any(p.kind is inspect.Parameter.VAR_KEYWORD for p in params.values())
+    return frozenset(params) - {"self"}, accepts_any
+
 # Dict类列表转变为BMC
 def Json2BMC(data: Dict[str, Any]) -> BaseMessageComponent:
     """
@@ -81,137 +241,66 @@ def Json2BMC(data: Dict[str, Any]) -> BaseMessageComponent:
 
     data_type: str | None = data.get("type")
 
+    # 纯文本占绝大多数，最先判断并直接构建，跳过其余所有检查与分发
+    if data_type == "text" or data_type == "plain":
+        return Plain(text=(data.get("data") or {}).get("text", ""))
+
     # 如果没有 type 字段
     if not data_type:
         data_text = json.dumps(data, ensure_ascii=False)
-        logger.debug(f"[Json2BMC] 未获取到data_type,data:{data_text}")
+        logger.debug("[Json2BMC] 未获取到data_type,data:%s", data_text)
         return Plain(text=data_text)
 
-    component_class = COMPONENT_TYPES.get(data_type.lower())
+    # 键均为小写：先按原样查找，未命中再转小写
+    component_class = COMPONENT_TYPES.get(data_type) or COMPONENT_TYPES.get(data_type.lower())
 
     # 未知类型
     if component_class is None:
         data_text = json.dumps(data, ensure_ascii=False)
-        logger.debug(f"[Json2BMC] 未知类型:{data_text}")
+        logger.debug("[Json2BMC] 未知类型:%s", data_text)
         return Unknown(text=data_text)
 
     data_content = data.get("data") or {}
 
     # ================= 特殊组件处理 =================
 
-    if component_class is Plain:
-        return Plain(text=data_content.get("text", ""))
-
-    if component_class is Image:
-        return Image(
-            file=data_content.get("file", ""),
-            url=data_content.get("url", ""),
-            path=data_content.get("path", "")
-        )
-
-    if component_class is Record:
-        return Record(
-            file=data_content.get("file", ""),
-            url=data_content.get("url", ""),
-            path=data_content.get("path", "")
-        )
-
-    if component_class is Video:
-        return Video(
-            file=data_content.get("file", ""),
-            cover=data_content.get("cover", ""),
-            path=data_content.get("path", "")
-        )
-
-    if component_class is File:
-        return File(
-            name=data_content.get("name", ""),
-            file=data_content.get("file", ""),
-            url=data_content.get("url", "")
-        )
-
-    if component_class is At:
-        qq = data_content.get("qq", "")
-        if qq == "all":
-            return AtAll()
-        return At(qq=qq, name=data_content.get("name", ""))
-
-    if component_class is Reply:
-        return Reply(
-            id=data_content.get("id", ""),
-            text=data_content.get("text", ""),
-            qq=data_content.get("qq", 0)
-        )
-
-    if component_class is Node:
-        content = data_content.get("content", [])
-        parsed_content = []
+    builder = _COMPONENT_BUILDERS.get(component_class)
+    if builder is not None:
+        return builder(data_content)
 
-        if isinstance(content, list):
-            for item in content:
-                if isinstance(item, dict):
-                    parsed_content.append(Json2BMC(item))
+    # ================= 通用安全创建 =================
 
-        return Node(
-            content=parsed_content,
-            name=data_content.get("name", ""),
-            uin=data_content.get("user_id", data_content.get("uin", "0")),
-            id=data_content.get("id", 0)
+    if not isinstance(data_content, dict):
+        logger.warning(
+            f"[Json2BMC] data 字段不是对象，转为 Unknown: {component_class.__name__}"
         )
+        return Unknown(text=json.dumps(data, ensure_ascii=False))
 
-    if component_class is Nodes:
-        nodes = data_content.get("nodes", [])
-        parsed_nodes = []
-
-        for node_data in nodes:
-            if isinstance(node_data, dict):
-                node_obj = Json2BMC(node_data)
-                if isinstance(node_obj, Node):
-                    parsed_nodes.append(node_obj)
-
-        return Nodes(nodes=parsed_nodes)
-
-    if component_class is Json:
-        json_data = data_content.get("data", {})
-        if isinstance(json_data, str):
-            return Json(data=json_data)
-        return Json(data=json.dumps(json_data, ensure_ascii=False))
-
-    if component_class is Poke:
-        return Poke(
-            type=data_content.get("type", ""),
-            id=data_content.get("id", 0),
-            qq=data_content.get("qq", 0)
+    # 安全参数过滤（基于 __init__ 签名）：构造前先剔除多余参数，常见路径不触发 TypeError
+    try:
+        valid_params, accepts_any = _init_params(component_class)
+    except (TypeError, ValueError):
+        valid_params, accepts_any = frozenset(), True
+    if not accepts_any and not data_content.keys() <= valid_params:
+        logger.warning(
+            f"[Json2BMC] 参数不匹配: {component_class.__name__}, "
+            f"忽略参数: {sorted(data_content.keys() - valid_params)}"
         )
-
-    # ================= 通用安全创建 =================
+        data_content = {
+            k: v for k, v in data_content.items()
+            if k in valid_params
+        }
 
     try:
         return component_class(**data_content)
 
     except TypeError as e:
         logger.warning(
-            f"[Json2BMC] 参数不匹配: {component_class.__name__}, err={e}"
+            f"[Json2BMC] 兜底失败，转为 Unknown: {component_class.__name__}, err={e}"
+        )
+        return Unknown(
+            text=json.dumps(data, ensure_ascii=False)
         )
-
-        # 安全参数过滤（基于 __init__ 签名）
-        try:
-            sig = inspect.signature(component_class.__init__)
-            valid_params = set(sig.parameters.keys()) - {"self"}
-            filtered = {
-                k: v for k, v in data_content.items()
-                if k in valid_params
-            }
-
-            return component_class(**filtered)
-
-        except Exception as inner_e:
-            logger.warning(
-                f"[Json2BMC] 兜底失败，转为 Unknown: {inner_e}"
-            )
-            return Unknown(
-                text=json.dumps(data, ensure_ascii=False)
-            )
 
 # 辅助函数：解析消息链
 def Json2BMCChain(data_list: List[Dict[str, Any]]) -> List[BaseMessageComponent]:
@@ -224,8 +313,4 @@ def Json2BMCChain(data_list: List[Dict[str, Any]]) -> List[BaseMessageComponent]
     Returns:
         List[BaseMessageComponent]: 消息组件对象列表
     """
-    components = []
-    for item in data_list:
-        if isinstance(item, dict):
-            components.append(Json2BMC(item))
-    return components
+    return [Json2BMC(item) for item in data_list if isinstance(item, dict)]